@@ -1,4 +1,6 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 
 import fastapi_offline_swagger_ui
 from fastapi import Depends, FastAPI
@@ -9,9 +11,25 @@ from fastapi.staticfiles import StaticFiles
 from utility import endpoints
 from utility.auth import authenticate
 from utility.database import create_indexes
+from utility.downloader import close_session
+from utility.kafka_producer import producer
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await create_indexes()
+    await endpoints.get_parser_manager()
+    yield
+    await asyncio.to_thread(endpoints.shutdown_parsers)
+    await close_session()
+    # Deliver whatever is still sitting in the producer's local queue, bounded so shutdown finishes
+    # well before the orchestrator gives up on the container
+    await asyncio.to_thread(producer.flush, 30)
+
 
 app = FastAPI(openapi_url="/cpe/api/openapi.json",
-              docs_url=None)  # Disable the default docs endpoint
+              docs_url=None,  # Disable the default docs endpoint
+              lifespan=lifespan)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -21,11 +39,6 @@ if os.path.exists(assets_path + "/swagger-ui.css") and os.path.exists(assets_pat
     app.mount("/cpe/api/assets", StaticFiles(directory=assets_path), name="static")
 
 
-@app.on_event("startup")
-async def startup_event():
-    await create_indexes()
-
-
 # Override the swagger UI HTML with basic auth protection
 @app.get("/cpe/api/docs", include_in_schema=False)
 async def get_swagger_ui(credentials: HTTPBasicCredentials = Depends(authenticate)):
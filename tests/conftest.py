@@ -0,0 +1,7 @@
+import os
+
+# The database, Kafka and Loki clients are created on import, they only need settings to exist.
+# Nothing in the tests connects to them.
+os.environ.setdefault("DATABASE_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DATABASE_NAME", "cpe_test")
+os.environ.setdefault("KAFKA_BOOTSTRAP_SERVER", "localhost:9092")
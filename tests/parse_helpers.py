@@ -0,0 +1,22 @@
+import itertools
+import os
+import signal
+
+# Stand-ins for the feed parsers, they have to live in an importable module to run in the parser processes
+
+BATCH = ['cpe:2.3:a:vendor:product:1.0:*:*:*:*:*:*:*', 'cpe:2.3:o:vendor:system:2.0:*:*:*:*:*:*:*']
+
+
+def parse_two_batches(path):
+    yield BATCH
+    yield BATCH
+
+
+def parse_endlessly(path):
+    return itertools.repeat(BATCH)
+
+
+def parse_and_die(path):
+    yield BATCH
+    # Killed like the OOM killer would, without a chance to send the end marker
+    os.kill(os.getpid(), signal.SIGKILL)
@@ -0,0 +1,44 @@
+import asyncio
+
+from utility import crud
+
+
+class FullQueueProducer:
+    # Takes `room` messages, after that the local queue stays full
+    def __init__(self, room):
+        self.room = room
+        self.sent = []
+        self.retries = 0
+
+    def add_message(self, topic, key, value):
+        if len(self.sent) >= self.room:
+            return False
+        self.sent.append((topic, key))
+        return True
+
+    async def retry_message(self, topic, key, value):
+        self.retries += 1
+        await asyncio.sleep(0)
+        return False
+
+    def poll(self):
+        pass
+
+
+def test_send_kafka_messages_counts_undeliverable_messages(monkeypatch):
+    producer = FullQueueProducer(room=3)
+    monkeypatch.setattr(crud, "producer", producer)
+    monkeypatch.setattr(crud, "stats", crud.Stats())
+    created = [(f"created-{i}", b"{}") for i in range(2)]
+    updated = [(f"updated-{i}", b"{}") for i in range(4)]
+
+    asyncio.run(crud.send_kafka_messages(created, updated))
+
+    assert producer.sent == [
+        ("cpe.extract.created", "created-0"),
+        ("cpe.extract.created", "created-1"),
+        ("cpe.extract.updated", "updated-0"),
+    ]
+    # The batch is given up on after the first message that could not be queued
+    assert producer.retries == 1
+    assert crud.stats.errors == 3
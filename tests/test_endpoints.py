@@ -0,0 +1,53 @@
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pytest
+
+from utility import endpoints
+from tests import parse_helpers
+
+FEED_PATH = Path('feed')
+
+
+@pytest.fixture(scope='module', autouse=True)
+def parsers():
+    yield
+    endpoints.shutdown_parsers()
+
+
+async def collect(parse_in_batches):
+    return [records async for records in endpoints.parse_in_process(parse_in_batches, FEED_PATH)]
+
+
+def test_end_marker_stops_the_consumer():
+    batches = asyncio.run(asyncio.wait_for(collect(parse_helpers.parse_two_batches), 30))
+
+    assert len(batches) == 2
+    assert [cpe_name for cpe_name, _, _ in batches[0]] == parse_helpers.BATCH
+
+
+def test_early_stop_unblocks_the_worker(monkeypatch):
+    # The worker is blocked on the full queue when the ingest stops
+    monkeypatch.setattr(endpoints, 'PARSED_QUEUE_SIZE', 1)
+
+    async def take_first():
+        batches = endpoints.parse_in_process(parse_helpers.parse_endlessly, FEED_PATH)
+        first = await anext(batches)
+        await batches.aclose()
+        return first
+
+    first = asyncio.run(asyncio.wait_for(take_first(), 30))
+
+    # aclose only returns once the worker has finished, so getting here means it was stopped
+    assert [cpe_name for cpe_name, _, _ in first] == parse_helpers.BATCH
+
+
+def test_worker_crash_renews_the_pool():
+    broken_pool = endpoints.parser_pool
+
+    with pytest.raises(BrokenProcessPool):
+        asyncio.run(asyncio.wait_for(collect(parse_helpers.parse_and_die), 30))
+
+    assert endpoints.parser_pool is not broken_pool
+    assert len(asyncio.run(asyncio.wait_for(collect(parse_helpers.parse_two_batches), 30))) == 2
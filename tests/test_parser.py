@@ -0,0 +1,93 @@
+import dataclasses
+import io
+
+import pytest
+
+from utility import parser
+
+# Expected values are what python-cpe 1.3.0 produced for the same URIs before it was replaced by the splitter
+MATCHES_PYTHON_CPE = [
+    ('cpe:2.3:a:microsoft:internet_explorer:8.0.6001:beta:*:*:*:*:*:*',
+     ('cpe:2.3:a:microsoft:internet_explorer:8.0.6001:beta:*:*:*:*:*:*', 'software', '8.0.6001', 'a', 'microsoft',
+      'internet_explorer', '8.0.6001', 'beta', '*', '*', '*', '*', '*', '*')),
+    ('cpe:2.3:o:linux:linux_kernel:5.10:-:*:*:*:*:x64:*',
+     ('cpe:2.3:o:linux:linux_kernel:5.10:-:*:*:*:*:x64:*', 'operating_system', '5.10', 'o', 'linux', 'linux_kernel',
+      '5.10', '-', '*', '*', '*', '*', 'x64', '*')),
+    ('cpe:2.3:h:cisco:asa_5505:-:*:*:*:*:*:*:*',
+     ('cpe:2.3:h:cisco:asa_5505:-:*:*:*:*:*:*:*', 'hardware', '-', 'h', 'cisco', 'asa_5505', '-', '*', '*', '*', '*',
+      '*', '*', '*')),
+    ('cpe:2.3:*:vendor:product:1:*:*:*:*:*:*:*',
+     ('cpe:2.3:*:vendor:product:1:*:*:*:*:*:*:*', 'other', '1', '*', 'vendor', 'product', '1', '*', '*', '*', '*', '*',
+      '*', '*')),
+    # Escaped colon stays inside its component
+    (r'cpe:2.3:a:foo\:bar:baz:1.0:*:*:*:*:*:*:*',
+     (r'cpe:2.3:a:foo\:bar:baz:1.0:*:*:*:*:*:*:*', 'software', '1.0', 'a', r'foo\:bar', 'baz', '1.0', '*', '*', '*',
+      '*', '*', '*', '*')),
+    # Escaped backslash does not escape the colon that follows it
+    (r'cpe:2.3:a:foo\\bar:baz:1.0:*:*:*:*:*:*:*',
+     (r'cpe:2.3:a:foo\\bar:baz:1.0:*:*:*:*:*:*:*', 'software', '1.0', 'a', r'foo\\bar', 'baz', '1.0', '*', '*', '*',
+      '*', '*', '*', '*')),
+    # python-cpe unescapes \- in the formatted string, cpe_name is the upsert key so it has to match
+    (r'cpe:2.3:a:1password:1password:7.0.2\-beta:*:*:*:*:*:*:*',
+     ('cpe:2.3:a:1password:1password:7.0.2-beta:*:*:*:*:*:*:*', 'software', r'7.0.2\-beta', 'a', '1password',
+      '1password', r'7.0.2\-beta', '*', '*', '*', '*', '*', '*', '*')),
+    ('CPE:2.3:A:Microsoft:Office:2016:*:*:*:*:*:*:*',
+     ('cpe:2.3:a:microsoft:office:2016:*:*:*:*:*:*:*', 'software', '2016', 'a', 'microsoft', 'office', '2016', '*', '*',
+      '*', '*', '*', '*', '*')),
+    ('cpe:2.3:a:microsoft:office:2016:*:*:en-us:*:*:*:*',
+     ('cpe:2.3:a:microsoft:office:2016:*:*:en-us:*:*:*:*', 'software', '2016', 'a', 'microsoft', 'office', '2016', '*',
+      '*', 'en-us', '*', '*', '*', '*')),
+]
+
+
+@pytest.mark.parametrize("cpe23Uri, expected", MATCHES_PYTHON_CPE)
+def test_decompose_cpe23_matches_python_cpe(cpe23Uri, expected):
+    assert dataclasses.astuple(parser.decompose_cpe23(cpe23Uri)) == expected
+
+
+@pytest.mark.parametrize("cpe23Uri", [
+    'cpe:2.3:a:vendor:product:1:*:*:*:*:*:*',  # One component short
+    'cpe:2.3:a:vendor:product:1:*:*:*:*:*:*:*:*',  # One component too many
+    'cpe:2.3:x:vendor:product:1:*:*:*:*:*:*:*',  # Unknown part
+    # python-cpe only allows \- among the escaped unreserved characters
+    r'cpe:2.3:a:vendor:product\.net:1.0:*:*:*:*:*:*:*',
+    r'cpe:2.3:a:vendor:my\_product:1.0:*:*:*:*:*:*:*',
+    'cpe:2.3:a:vendor:product%20name:1.0:*:*:*:*:*:*:*',
+    'cpe:2.3:a:vendor:product name:1.0:*:*:*:*:*:*:*',
+    'cpe:2.3:a:vendor::1.0:*:*:*:*:*:*:*',  # Empty product
+    'cpe:2.3:a:vendor:product:1.0:*:*:*:*:*:*:',  # Empty trailing component
+    'cpe:2.3:a:vendor:product:1.0:*:*:english:*:*:*:*',  # Not a language tag
+    # CPE 2.2 URI binding: python-cpe accepted it, the feeds only carry 2.3 formatted strings
+    'cpe:/a:microsoft:internet_explorer:8.0.6001',
+])
+def test_decompose_cpe23_rejects_malformed_uris(cpe23Uri):
+    assert parser.decompose_cpe23(cpe23Uri) is None
+
+
+def cpe_dictionary(cpe23Uris):
+    items = "".join(
+        f'<cpe-item name="cpe:/a:x:y"><title>t</title><cpe-23:cpe23-item name="{cpe23Uri}"/></cpe-item>'
+        for cpe23Uri in cpe23Uris
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<cpe-list xmlns="http://cpe.mitre.org/dictionary/2.0" '
+        'xmlns:cpe-23="http://scap.nist.gov/schema/cpe-extension/2.3">'
+        f'{items}<cpe-item name="cpe:/a:x:z"><title>no 2.3 name</title></cpe-item></cpe-list>'
+    ).encode()
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 64, 1024 * 1024])
+def test_iter_xml_cpe23_uris_across_chunk_boundaries(monkeypatch, read_size):
+    cpe23Uris = [uri for uri, _ in MATCHES_PYTHON_CPE]
+    monkeypatch.setattr(parser, "XML_READ_SIZE", read_size)
+
+    assert list(parser.iter_xml_cpe23_uris(io.BytesIO(cpe_dictionary(cpe23Uris)))) == cpe23Uris
+
+
+def test_decompose_cpe23_cached_instances_are_frozen():
+    cpe = parser.decompose_cpe23('cpe:2.3:a:vendor:product:1.0:*:*:*:*:*:*:*')
+
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        cpe.version = '2.0'
+    assert parser.decompose_cpe23('cpe:2.3:a:vendor:product:1.0:*:*:*:*:*:*:*') is cpe
@@ -1,26 +1,36 @@
-import os
+from functools import lru_cache
+from typing import Optional
 
 from dotenv import load_dotenv
-from pydantic_settings import BaseSettings
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 load_dotenv()
 
 
 class Settings(BaseSettings):
-    DATABASE_URL: str = os.getenv('DATABASE_URL')
-    DATABASE_NAME: str = os.getenv('DATABASE_NAME')
-    CPE_URL: str = os.getenv('CPE_V23_URL')
-    KAFKA_BOOTSTRAP_SERVERS: str = os.getenv('KAFKA_BOOTSTRAP_SERVER')
-    KAFKA_TOPIC: str = os.getenv('KAFKA_TOPIC')
+    # Fields are read from the environment by name, aliases cover the ones whose variable is named differently
+    DATABASE_URL: Optional[str] = None
+    DATABASE_NAME: Optional[str] = None
+    CPE_URL: Optional[str] = Field(default=None, validation_alias='CPE_V23_URL')
+    KAFKA_BOOTSTRAP_SERVERS: Optional[str] = Field(default=None, validation_alias='KAFKA_BOOTSTRAP_SERVER')
+    KAFKA_TOPIC: Optional[str] = None
     FILES_BASE_DIR: str = 'data'
-    LOKI_URL: str = os.getenv('LOKI_URL')
-    CPE_MODIFIED_URL: str = os.getenv('NVD_MODIFIED_URL')
-    CPE_RECENT_URL: str = os.getenv('NVD_RECENT_URL')
-    DEFAULT_PASSWORD: str = os.getenv('DEFAULT_PASSWORD')
-    DEFAULT_USERNAME: str = os.getenv('DEFAULT_USERNAME')
+    DOWNLOAD_VERIFY_SSL: bool = True
+    INGEST_WORKERS: int = 4
+    LOKI_URL: Optional[str] = None
+    CPE_MODIFIED_URL: Optional[str] = Field(default=None, validation_alias='NVD_MODIFIED_URL')
+    CPE_RECENT_URL: Optional[str] = Field(default=None, validation_alias='NVD_RECENT_URL')
+    DEFAULT_PASSWORD: Optional[str] = None
+    DEFAULT_USERNAME: Optional[str] = None
+    VERIFICATION_TOKEN: Optional[str] = None
 
-    class Config:
-        env_file = "../.env"
+    model_config = SettingsConfigDict(env_file="../.env", extra='ignore')
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    return Settings()
+
+
+settings = get_settings()
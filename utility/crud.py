@@ -1,31 +1,42 @@
 import asyncio
 import time
+from dataclasses import asdict, dataclass
 from datetime import datetime
 from functools import wraps
+from itertools import chain
 from pathlib import Path
-from typing import Optional, List
+from typing import AsyncIterable, Optional, List
+from zoneinfo import ZoneInfo
 
-import aiofiles
-import pytz
 from pymongo import UpdateOne
 from pymongo.errors import BulkWriteError
 
+from .config import settings
 from .database import cpe_collection
 from .kafka_producer import producer
 from .logger import LogManager
-from .schemas import CPEResponse, CPECreate
+from .parser import CPERecord
+from .schemas import CPEResponse
 
-tehran_tz = pytz.timezone('Asia/Tehran')
+tehran_tz = ZoneInfo('Asia/Tehran')
 
 logger = LogManager('crud.py')
 
-stats = {
-    "inserted": 0,
-    "updated": 0,
-    "errors": 0,
-    "last_called": None,
-    "durations": None
-}
+INGEST_QUEUE_SIZE = 4  # Batches, not records
+# Operations per bulk_write; a parsed batch of 2000 records is written as four concurrent sub-batches
+BULK_WRITE_SIZE = 500
+
+
+@dataclass
+class Stats:
+    inserted: int = 0
+    updated: int = 0
+    errors: int = 0
+    last_called: Optional[str] = None
+    durations: Optional[float] = None  # Seconds, humanized when read through get_stats
+
+
+stats = Stats()
 
 
 async def get_cpe(cpe_name: str) -> Optional[CPEResponse]:
@@ -34,115 +45,156 @@ async def get_cpe(cpe_name: str) -> Optional[CPEResponse]:
         return CPEResponse(**document)
 
 
-async def bulk_create_or_update_cpes(cpes: List[CPECreate], batch_size=1_000):
-    global stats
+async def bulk_create_or_update_cpes(records: List[CPERecord], batch_size=BULK_WRITE_SIZE):
     operations = []
     created_cpes = []
     updated_cpes = []
-    cpe_objects = []
+    cpe_records = []
 
-    for cpe in cpes:
+    for cpe_name, payload, payload_json in records:
         operations.append(
             UpdateOne(
-                {"cpe_name": cpe.cpe_name},
-                {"$set": cpe.dict()},
+                {"cpe_name": cpe_name},
+                {"$set": payload},
                 upsert=True
             )
         )
-        cpe_objects.append(cpe)  # Track the CPE object for each operation
+        cpe_records.append((cpe_name, payload_json))
 
-        if len(operations) >= batch_size:
-            await execute_bulk_write(operations, created_cpes, updated_cpes, cpe_objects)
-            operations = []
-            cpe_objects = []
+    # Unordered sub-batches are independent, so they go to the server side by side instead of one after the other
+    await asyncio.gather(*(
+        execute_bulk_write(operations[i:i + batch_size], created_cpes, updated_cpes, cpe_records[i:i + batch_size])
+        for i in range(0, len(operations), batch_size)
+    ))
 
-    if operations:
-        await execute_bulk_write(operations, created_cpes, updated_cpes, cpe_objects)
+    await send_kafka_messages(created_cpes, updated_cpes)
 
-    await send_kafka_messages_in_batches(created_cpes, updated_cpes)
 
+async def ingest_worker(queue: asyncio.Queue):
+    while True:
+        batch = await queue.get()
+        if batch is None:
+            break
+        try:
+            await bulk_create_or_update_cpes(batch)
+        except Exception as e:
+            # A failed batch must not end the worker, the ingest would stall once no worker is left
+            logger.error(f"Error while ingesting a batch of {len(batch)} CPEs: {str(e)}")
+            stats.errors += 1
 
-async def execute_bulk_write(operations, created_cpes, updated_cpes, cpe_objects):
-    try:
-        result = await cpe_collection.bulk_write(operations)
-
-        matched_count = result.matched_count
-        upserted_count = len(result.upserted_ids)
 
-        # Match the operations with the corresponding CPE objects
-        for i, cpe in enumerate(cpe_objects):
-            if i in result.upserted_ids:
-                created_cpes.append(cpe)
-            else:
-                updated_cpes.append(cpe)
+async def ingest_cpes(batches: AsyncIterable[List[CPERecord]], workers: int = settings.INGEST_WORKERS):
+    # The bound gives backpressure: parsing pauses once every worker has a batch waiting
+    queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    tasks = [asyncio.create_task(ingest_worker(queue)) for _ in range(workers)]
 
-        stats['inserted'] += upserted_count
-        stats['updated'] += matched_count
+    try:
+        async for batch in batches:
+            await queue.put(batch)
+        # One sentinel per worker so each of them exits once the queue is drained
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        # Only does something when parsing failed or the ingest was cancelled, nobody drains the queue then
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # The producer batches on its own, a single flush once the whole ingest is written is enough
+        await asyncio.to_thread(producer.flush, 30)
+
+
+async def execute_bulk_write(operations, created_cpes, updated_cpes, cpe_records):
+    try:
+        # ordered=False lets the server apply the whole batch in one pass and keep going past failed operations
+        result = await cpe_collection.bulk_write(operations, ordered=False, bypass_document_validation=True)
+        matched_count = result.matched_count
+        upserted_indexes = set(result.upserted_ids)
+        failed_indexes = set()
     except BulkWriteError as bwe:
         logger.error(f"Bulk write error: {bwe.details}")
-        stats['error'] += 1
+        # The rest of an unordered batch is still applied, so account for what did succeed
+        matched_count = bwe.details.get('nMatched', 0)
+        upserted_indexes = {upsert['index'] for upsert in bwe.details.get('upserted', [])}
+        failed_indexes = {error['index'] for error in bwe.details.get('writeErrors', [])}
+        stats.errors += 1
     except Exception as e:
         logger.error(f"General error during bulk write: {str(e)}")
-        stats['error'] += 1
-
-
-async def send_kafka_messages_in_batches(created_cpes, updated_cpes, batch_size=1_000):
-    created_batches = [created_cpes[i:i + batch_size] for i in range(0, len(created_cpes), batch_size)]
-    updated_batches = [updated_cpes[i:i + batch_size] for i in range(0, len(updated_cpes), batch_size)]
-
-    for batch in created_batches:
-        for cpe in batch:
-            producer.add_message('cpe.extract.created', key=str(cpe.cpe_name), value=cpe.json())
-        await asyncio.to_thread(producer.flush)
-
-    for batch in updated_batches:
-        for cpe in batch:
-            producer.add_message('cpe.extract.updated', key=str(cpe.cpe_name), value=cpe.json())
-        await asyncio.to_thread(producer.flush)
+        stats.errors += 1
+        return
+
+    # Match the operations with the corresponding CPE records
+    for i, record in enumerate(cpe_records):
+        if i in failed_indexes:
+            continue
+        if i in upserted_indexes:
+            created_cpes.append(record)
+        else:
+            updated_cpes.append(record)
+
+    stats.inserted += len(upserted_indexes)
+    stats.updated += matched_count
+
+
+async def send_kafka_messages(created_cpes, updated_cpes):
+    messages = list(chain(
+        (('cpe.extract.created', cpe_name, payload_json) for cpe_name, payload_json in created_cpes),
+        (('cpe.extract.updated', cpe_name, payload_json) for cpe_name, payload_json in updated_cpes)
+    ))
+
+    for sent, (topic, cpe_name, payload_json) in enumerate(messages):
+        if producer.add_message(topic, key=cpe_name, value=payload_json):
+            continue
+        # Local queue is full, wait for room without blocking the event loop
+        if not await producer.retry_message(topic, key=cpe_name, value=payload_json):
+            # The broker is not taking messages, the rest of the batch would only wait out the same retries
+            undeliverable = len(messages) - sent
+            logger.error(f"Kafka producer queue stayed full, {undeliverable} CPE messages were not sent")
+            stats.errors += undeliverable
+            break
+
+    producer.poll()
 
 
 async def reset_stats():
     global stats
-    stats = {
-        "inserted": 0,
-        "updated": 0,
-        "errors": 0,
-        "last_called": None,
-        "durations": None
-    }
+    stats = Stats()
+
+
+def humanize_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.2f} seconds"
+    if seconds < 3600:
+        return f"{seconds / 60:.2f} minutes"
+    return f"{seconds / 3600:.2f} hours"
 
 
 async def get_stats():
-    return stats
+    current = asdict(stats)
+    if stats.durations is not None:
+        current["durations"] = humanize_duration(stats.durations)
+    return current
 
 
 def record_stats():
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            start_time = time.time()
+            started_at = datetime.now(tehran_tz)
+            # Monotonic clock so the duration is not skewed by wall-clock adjustments
+            start_time = time.monotonic()
             try:
                 result = await func(*args, **kwargs)
             except Exception as e:
                 logger.error(e)
                 result = None
-            end_time = time.time()
-            duration = end_time - start_time
-
-            # Determine appropriate time unit
-            minutes, seconds = divmod(duration, 60)
-            hours, minutes = divmod(minutes, 60)
+            end_time = time.monotonic()
 
-            human_readable_duration = (
-                f"{hours:.2f} hours" if hours >= 1 else
-                f"{minutes:.2f} minutes" if minutes >= 1 else
-                f"{seconds:.2f} seconds"
+            stats.last_called = (
+                f"{started_at.year}-{started_at.month:02d}-{started_at.day:02d} "
+                f"{started_at.hour:02d}:{started_at.minute:02d}:{started_at.second:02d}"
             )
-
-            start_time_dt = datetime.fromtimestamp(start_time, tz=pytz.utc).astimezone(tehran_tz)
-
-            stats["last_called"] = start_time_dt.strftime('%Y-%m-%d %H:%M:%S')
-            stats["durations"] = human_readable_duration
+            stats.durations = end_time - start_time
 
             return result
 
@@ -151,13 +203,9 @@ def record_stats():
     return decorator
 
 
-async def read_version_file(version_file_path: Path) -> str:
-    async with aiofiles.open(version_file_path, 'r') as file:
-        version = await file.read()
-    return version.strip()
+def read_version_file(version_file_path: Path) -> str:
+    return version_file_path.read_text().strip()
 
 
-async def read_markdown_file(markdown_file_path: Path) -> str:
-    async with aiofiles.open(markdown_file_path, 'r') as file:
-        content = await file.read()
-    return content
+def read_markdown_file(markdown_file_path: Path) -> str:
+    return markdown_file_path.read_text()
@@ -1,18 +1,33 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, IndexModel, WriteConcern
 
 from .config import settings
 
-client = AsyncIOMotorClient(settings.DATABASE_URL)
+# /recent ingests two feeds at once, each ingest worker has up to four sub-batch bulk writes in flight
+# (crud.BULK_WRITE_SIZE), and /detail reads get their own connections on top of that.
+CONCURRENT_INGESTS = 2
+WRITES_PER_INGEST_WORKER = 4
+API_CONNECTIONS = 8
+MAX_POOL_SIZE = CONCURRENT_INGESTS * settings.INGEST_WORKERS * WRITES_PER_INGEST_WORKER + API_CONNECTIONS
+
+# Compressors are negotiated with the server in order, zlib needs no extra package and is the last resort.
+client = AsyncIOMotorClient(settings.DATABASE_URL,
+                            maxPoolSize=MAX_POOL_SIZE,
+                            compressors='zstd,snappy,zlib',
+                            retryWrites=True)
 database = client[settings.DATABASE_NAME]
-cpe_collection = database.get_collection("cpe")
 
+# The health probe has its own single connection and gives up quickly, the ingest client keeps the default
+# 30s server selection so a replica set election does not fail its writes
+health_client = AsyncIOMotorClient(settings.DATABASE_URL,
+                                   maxPoolSize=1,
+                                   serverSelectionTimeoutMS=2_000,
+                                   connectTimeoutMS=2_000)
 
-async def ensure_collection_exists():
-    await cpe_collection.insert_one({"_id": "dummy_id"})
-    await cpe_collection.delete_one({"_id": "dummy_id"})
+# Acknowledged by the primary without waiting for the journal; the data can always be re-ingested
+cpe_collection = database.get_collection("cpe", write_concern=WriteConcern(w=1, j=False))
 
 
 async def create_indexes():
-    await ensure_collection_exists()
-
-    await cpe_collection.create_index("cpe_name", unique=True)
+    # create_indexes materializes the collection itself, no placeholder write is needed
+    await cpe_collection.create_indexes([IndexModel([("cpe_name", ASCENDING)], unique=True)])
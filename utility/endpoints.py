@@ -1,49 +1,145 @@
 import asyncio
-import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.managers import SyncManager
 from pathlib import Path
+from queue import Empty
+from typing import AsyncGenerator, Callable, Dict, Iterator, List, Optional, Tuple
 
 import markdown2
-from dotenv import load_dotenv
-from fastapi import APIRouter, BackgroundTasks
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import APIRouter, BackgroundTasks, Header
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 
 from .config import settings
 from .crud import reset_stats, get_stats, record_stats, read_version_file, \
-    read_markdown_file, get_cpe, bulk_create_or_update_cpes
+    read_markdown_file, get_cpe, ingest_cpes
 from .downloader import download_file
 from .extractor import extract_zip
 from .health_check import check_mongo, check_kafka, check_url, check_internet_connection, check_loki
 from .logger import LogManager
-from .parser import parse_cpes_from_cve_json_in_batches, parse_xml_in_batches
-
-load_dotenv()
+from .parser import CPERecord, parse_cpes_from_cve_json_in_batches, parse_xml_archive_in_batches, \
+    parse_file_to_queue
 
 logger = LogManager('endpoints.py')
 
-router = APIRouter()
+# orjson for every JSON body the endpoints return, plain dicts and models included
+router = APIRouter(default_response_class=ORJSONResponse)
 
 VERSION_FILE_PATH = Path(__file__).parent.parent / 'version.txt'
 README_FILE_PATH = Path(__file__).parent.parent / 'README.md'
 
+# Parsed batches waiting to be written, per feed
+PARSED_QUEUE_SIZE = 8
+
+# forkserver keeps the workers clear of the Mongo and Kafka client threads of this process
+mp_context = multiprocessing.get_context('forkserver')
+# Two workers so the recent and modified feeds are parsed at the same time
+PARSER_WORKERS = 2
+parser_pool = ProcessPoolExecutor(max_workers=PARSER_WORKERS, mp_context=mp_context)
+
+# Serves the queues between the parser processes and this one, started once and shared by all ingests
+parser_manager: Optional[SyncManager] = None
+parser_manager_lock = asyncio.Lock()
+
+
+async def get_parser_manager() -> SyncManager:
+    global parser_manager
+    async with parser_manager_lock:
+        if parser_manager is None:
+            # Starting the manager spawns its server process, that is kept off the event loop
+            parser_manager = await asyncio.to_thread(mp_context.Manager)
+    return parser_manager
+
+
+def renew_parser_pool(broken_pool: ProcessPoolExecutor):
+    global parser_pool
+    # A dead worker (e.g. OOM killed) breaks the whole pool for good, later ingests get a fresh one.
+    # Both feeds can hit the same broken pool, only the first one replaces it.
+    if parser_pool is broken_pool:
+        logger.error("Parser process pool is broken, starting a new one.")
+        parser_pool = ProcessPoolExecutor(max_workers=PARSER_WORKERS, mp_context=mp_context)
+        broken_pool.shutdown(wait=False)
+
+
+def shutdown_parsers():
+    # The manager goes first, a worker blocked on one of its queues fails instead of keeping the pool waiting
+    if parser_manager is not None:
+        parser_manager.shutdown()
+    parser_pool.shutdown(cancel_futures=True)
+
+
+# Rendered file contents keyed by path, together with the mtime they were read at
+file_cache: Dict[Path, Tuple[int, str]] = {}
+
+
+def load_cached(path: Path, load: Callable[[Path], str]) -> Tuple[str, str]:
+    # Both files only change with a deploy, so they are only read (and rendered) again once their mtime moves.
+    # A missing file raises FileNotFoundError here and is retried on the next request.
+    mtime_ns = path.stat().st_mtime_ns
+    cached = file_cache.get(path)
+    if cached is None or cached[0] != mtime_ns:
+        cached = (mtime_ns, load(path))
+        file_cache[path] = cached
+    return f'"{mtime_ns}"', cached[1]
+
+
+def render_readme(readme_file_path: Path) -> str:
+    return markdown2.markdown(read_markdown_file(readme_file_path))
+
 
 async def download_and_extract(url: str, zip_path: Path, extract_to: Path) -> Path:
-    await reset_stats()
     await download_file(url, zip_path)
     await extract_zip(zip_path, extract_to)
     return extract_to / zip_path.stem
 
 
-async def process_cpes_in_batches(json_file_path: Path):
+async def parse_in_process(parse_in_batches: Callable[[Path], Iterator[List[str]]],
+                           path: Path) -> AsyncGenerator[List[CPERecord], None]:
+    # Parsing, validation and serialization run in a parser process, this loop only forwards the batches
+    loop = asyncio.get_running_loop()
+    manager = await get_parser_manager()
+    queue = await asyncio.to_thread(manager.Queue, PARSED_QUEUE_SIZE)
+    stop = await asyncio.to_thread(manager.Event)
+
+    pool = parser_pool
+    try:
+        parsing = loop.run_in_executor(pool, parse_file_to_queue, parse_in_batches, path, queue, stop)
+    except BrokenProcessPool:
+        renew_parser_pool(pool)
+        raise
+
     try:
-        semaphore = asyncio.Semaphore(10)
+        while True:
+            try:
+                records = await asyncio.to_thread(queue.get, True, 1)
+            except Empty:
+                if parsing.done():
+                    break  # The worker died before it could send the end marker
+                continue
+            if records is None:
+                break
+            yield records
+    finally:
+        if not parsing.done():
+            # The ingest stopped early: stop the worker and unblock it if it is waiting on a full queue
+            await asyncio.to_thread(stop.set)
+            while not parsing.done():
+                try:
+                    await asyncio.to_thread(queue.get, True, 1)
+                except Empty:
+                    pass
 
-        async def process_batch(batch):
-            async with semaphore:
-                await bulk_create_or_update_cpes(batch)
+    try:
+        await parsing
+    except BrokenProcessPool:
+        renew_parser_pool(pool)
+        raise
 
-        async for batch in parse_xml_in_batches(json_file_path):
-            await process_batch(batch)
 
+async def process_cpes_in_batches(zip_path: Path):
+    try:
+        await ingest_cpes(parse_in_process(parse_xml_archive_in_batches, zip_path))
     except Exception as e:
         logger.error(f"Error during processing CPEs in batches: {str(e)}")
 
@@ -52,15 +148,15 @@ async def process_cpes_in_batches(json_file_path: Path):
 async def update_cpes():
     try:
         base_dir = Path(settings.FILES_BASE_DIR) / 'downloaded'
-        extract_to = base_dir / 'extracted_files'
 
         url = settings.CPE_URL
         zip_path = base_dir / 'official-cpe-dictionary_v2.3.xml.zip'
 
-        json_file_path = await download_and_extract(url, zip_path, extract_to)
+        await reset_stats()
+        await download_file(url, zip_path)
 
-        # Process batches from the XML file
-        await process_cpes_in_batches(json_file_path)
+        # Process batches from the XML file inside the archive
+        await process_cpes_in_batches(zip_path)
         logger.info("Getting all CPEs completed.")
     except Exception as e:
         logger.error(f"Error during getting all CPEs: {str(e)}")
@@ -68,19 +164,11 @@ async def update_cpes():
 
 async def process_recent_cpes_in_batches(json_file_path: Path):
     try:
-        semaphore = asyncio.Semaphore(10)
-
-        async def process_batch(batch):
-            async with semaphore:
-                await bulk_create_or_update_cpes(batch)
-
-        async for batch in parse_cpes_from_cve_json_in_batches(json_file_path):
-            await process_batch(batch)
+        await ingest_cpes(parse_in_process(parse_cpes_from_cve_json_in_batches, json_file_path))
     except Exception as e:
         logger.error(f"Error during processing CPEs in batches: {str(e)}")
 
 
-@record_stats()
 async def update_recent_cpes(feed_type: str):
     try:
         base_dir = Path(settings.FILES_BASE_DIR) / 'downloaded'
@@ -91,14 +179,21 @@ async def update_recent_cpes(feed_type: str):
         json_file_path = await download_and_extract(url, zip_path, extract_to)
 
         await process_recent_cpes_in_batches(json_file_path)
-        logger.info("Getting recent and modified CPEs completed.")
+        logger.info(f"Getting {feed_type} CPEs completed.")
     except Exception as e:
-        logger.error(f"Error during getting modified and recent CPEs: {str(e)}")
+        logger.error(f"Error during getting {feed_type} CPEs: {str(e)}")
+
+
+@record_stats()
+async def update_recent_and_modified_cpes():
+    await reset_stats()
+    # Both feeds share the stats, so they are reset once and filled by both runs
+    await asyncio.gather(update_recent_cpes("recent"), update_recent_cpes("modified"))
 
 
 @router.post("/all")
 async def update_cpes_endpoint(background_tasks: BackgroundTasks, token: str):
-    if not token == os.getenv('VERIFICATION_TOKEN'):
+    if not token == settings.VERIFICATION_TOKEN:
         return {"error": "Invalid request"}
 
     try:
@@ -112,13 +207,12 @@ async def update_cpes_endpoint(background_tasks: BackgroundTasks, token: str):
 
 @router.post("/recent")
 async def update_recent_cpes_endpoint(background_tasks: BackgroundTasks, token: str):
-    if not token == os.getenv('VERIFICATION_TOKEN'):
+    if not token == settings.VERIFICATION_TOKEN:
         return {"error": "Invalid request"}
 
     try:
         logger.info("Received update CPE request.")
-        background_tasks.add_task(update_recent_cpes, "recent")
-        background_tasks.add_task(update_recent_cpes, "modified")
+        background_tasks.add_task(update_recent_and_modified_cpes)
         return {"message": 'Started updating CPEs in the background!'}
     except Exception as e:
         logger.error(f"Error in update_recent_CPEs_endpoint: {str(e)}")
@@ -132,11 +226,21 @@ async def get_cpes_stats():
 
 @router.get("/health_check")
 async def check_health():
-    mongo_status = await check_mongo()
-    kafka_status = await check_kafka()
-    cpe_status = await check_url(settings.CPE_URL)
-    loki_status = await check_loki()
-    internet_status = await check_internet_connection()
+    # The probes are independent, so the endpoint takes as long as the slowest one instead of their sum
+    results = await asyncio.gather(
+        check_internet_connection(),
+        check_mongo(),
+        check_kafka(),
+        check_url(settings.CPE_URL),
+        check_loki(),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.error(f"Health check probe failed: {str(result)}")
+    internet_status, mongo_status, kafka_status, cpe_status, loki_status = (
+        result is True for result in results
+    )
 
     return {
         "internet": internet_status,
@@ -148,10 +252,12 @@ async def check_health():
 
 
 @router.get("/version")
-async def get_version():
+async def get_version(if_none_match: Optional[str] = Header(None)):
     try:
-        version = await read_version_file(VERSION_FILE_PATH)
-        return {"version": version}
+        etag, version = load_cached(VERSION_FILE_PATH, read_version_file)
+        if if_none_match == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return ORJSONResponse(content={"version": version}, headers={"ETag": etag})
     except FileNotFoundError as e:
         logger.error(e)
     except Exception as e:
@@ -159,15 +265,17 @@ async def get_version():
 
 
 @router.get("/readme", response_class=HTMLResponse)
-async def get_readme():
+async def get_readme(if_none_match: Optional[str] = Header(None)):
     try:
-        content = await read_markdown_file(README_FILE_PATH)
-        html_content = markdown2.markdown(content)
-        return HTMLResponse(content=html_content, headers={"Content-Type": "text/markdown; charset=utf-8"},
+        etag, html_content = load_cached(README_FILE_PATH, render_readme)
+        if if_none_match == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return HTMLResponse(content=html_content,
+                            headers={"Content-Type": "text/markdown; charset=utf-8", "ETag": etag},
                             status_code=200)
     except FileNotFoundError as e:
         logger.error(e)
-        return JSONResponse(status_code=404, content={"message": "File not found"})
+        return ORJSONResponse(status_code=404, content={"message": "File not found"})
     except Exception as e:
         logger.error(e)
 
@@ -176,5 +284,5 @@ async def get_readme():
 async def get_detail(cpe_name: str):
     cpe = await get_cpe(cpe_name)
     if not cpe:
-        return JSONResponse(status_code=404, content={"message": f'{cpe_name} not found'})
+        return ORJSONResponse(status_code=404, content={"message": f'{cpe_name} not found'})
     return cpe
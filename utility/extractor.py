@@ -1,7 +1,9 @@
 import asyncio
 import os
 import zipfile
+from contextlib import contextmanager
 from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
 
 from .logger import LogManager
 
@@ -19,3 +21,11 @@ async def extract_zip(zip_path: Path, extract_to: Path):
 def extract_zip_sync(zip_path: Path, extract_to: Path):
     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
         zip_ref.extractall(extract_to)
+
+
+@contextmanager
+def open_zip_member(zip_path: Path, member: Optional[str] = None) -> Iterator[BinaryIO]:
+    # Decompress the member on the fly while it is being read instead of extracting it to disk first
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        with zip_ref.open(member or zip_path.stem, 'r') as member_file:
+            yield member_file
@@ -1,3 +1,4 @@
+import asyncio
 import socket
 import time
 
@@ -5,7 +6,7 @@ import aiohttp
 from httpx import AsyncClient
 
 from .config import settings
-from .database import client
+from .database import health_client
 from .kafka_producer import producer
 from .logger import LogManager
 
@@ -14,22 +15,17 @@ logger = LogManager('health_check.py')
 
 async def check_mongo():
     try:
-        client.admin.command('ping')
+        await health_client.admin.command('ping')
         return True
-    except ConnectionError as e:
+    except Exception as e:
         logger.error(e)
         return False
 
 
 async def check_kafka():
     try:
-        test_topic = "test"
-        test_key = "test_key"
-        test_value = "test_value"
-
-        producer.add_message(test_topic, test_key, test_value)
-        producer.flush()
-
+        # Blocking call runs in a thread so the other health probes keep going meanwhile
+        await asyncio.to_thread(producer.check_connection)
         return True
     except Exception as e:
         logger.error(e)
@@ -72,7 +68,8 @@ async def check_loki():
 
 async def check_internet_connection():
     try:
-        socket.create_connection(("8.8.8.8", 53), timeout=2)
+        connection = await asyncio.to_thread(socket.create_connection, ("8.8.8.8", 53), 2)
+        connection.close()
         return True
     except OSError as e:
         logger.error(e)
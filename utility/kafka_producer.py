@@ -1,3 +1,5 @@
+import asyncio
+
 from confluent_kafka import Producer
 
 from .config import settings
@@ -5,37 +7,64 @@ from .logger import LogManager
 
 logger = LogManager('kafka_producer.py')
 
+# Waits of 0.1s for room in the local queue before a message is given up on
+PRODUCE_RETRIES = 50
+
 
 class KafkaProducer:
     def __init__(self, config):
         self.producer = Producer({
             'bootstrap.servers': config,
-            'queue.buffering.max.messages': 100_000,  # Increase buffer size for batching
-            'queue.buffering.max.ms': 100,  # Reduce the maximum time to buffer messages (default is 1000ms)
+            'queue.buffering.max.messages': 500_000,  # Room for a whole ingest run without blocking add_message
+            'queue.buffering.max.kbytes': 1_048_576,  # 1GB
+            'linger.ms': 100,  # Wait up to 100ms so messages coalesce into fewer broker requests
+            'batch.size': 1_048_576,  # Max bytes per partition batch, lz4 compresses the JSON payloads well
             'batch.num.messages': 10_000,  # Increase the batch size to reduce network overhead
-            'compression.codec': 'gzip',  # Use gzip for compression to reduce payload size
-            'linger.ms': 50,  # Reduce latency by waiting for a few milliseconds before sending a batch
+            'compression.codec': 'lz4',  # lz4 is much cheaper on CPU than gzip for small JSON payloads
             'message.max.bytes': 10485760,  # Max message size (10MB)
             'message.timeout.ms': 600000,  # Timeout for message delivery
-            'acks': 'all',  # Wait for leader acknowledgement (use 'all' for stronger consistency)
-            'enable.idempotence': True  # Ensure idempotence for safer retries and exactly-once semantics
+            'acks': 'all',  # Required by idempotence
+            'enable.idempotence': True,  # Ensure idempotence for safer retries and exactly-once semantics
+            'max.in.flight.requests.per.connection': 5,  # Highest value allowed with idempotence
+            # Successful deliveries produce no report at all, the callback only runs for failures
+            'delivery.report.only.error': True,
+            'on_delivery': self.delivery_report
         })
-        self.message_queue = []
 
     def delivery_report(self, err, msg):
         if err is not None:
             logger.error(err)
 
-    def add_message(self, topic, key, value):
-        self.message_queue.append((topic, key, value))
-        if len(self.message_queue) >= 1_000:
-            self.flush()
+    def add_message(self, topic, key, value) -> bool:
+        # librdkafka batches internally based on linger.ms/batch.size, so messages are
+        # handed over right away instead of being held and flushed in Python.
+        # Never blocks: False means the local queue is full, see retry_message.
+        try:
+            self.producer.produce(topic, key=key, value=value)
+            return True
+        except BufferError:
+            return False
+
+    async def retry_message(self, topic, key, value) -> bool:
+        for _ in range(PRODUCE_RETRIES):
+            # Serve delivery reports off the event loop so delivered messages free up space
+            await asyncio.to_thread(self.producer.poll, 0.1)
+            if self.add_message(topic, key, value):
+                return True
+        return False
+
+    def poll(self):
+        # Non-blocking, serves the delivery reports that are already waiting in one call for a whole batch
+        self.producer.poll(0)
+
+    def check_connection(self, timeout: float = 5):
+        # A metadata request answers on its own, it does not queue behind the messages waiting for delivery
+        self.producer.list_topics(timeout=timeout)
 
-    def flush(self):
-        for topic, key, value in self.message_queue:
-            self.producer.produce(topic, key=key, value=value, callback=self.delivery_report)
-        self.producer.flush()
-        self.message_queue = []
+    def flush(self, timeout: float = -1):
+        remaining = self.producer.flush(timeout)
+        if remaining:
+            logger.error(f"{remaining} Kafka messages were still undelivered after flushing")
 
 
 producer = KafkaProducer(settings.KAFKA_BOOTSTRAP_SERVERS)
@@ -1,5 +1,6 @@
+from dataclasses import dataclass
+
 from bson import ObjectId
-from pydantic import BaseModel
 
 
 class PyObjectId(ObjectId):
@@ -18,7 +19,11 @@ class PyObjectId(ObjectId):
         field_schema.update(type="string")
 
 
-class CPECreate(BaseModel):
+# Built for every parsed URI on the ingest path where nothing needs validating,
+# so a slotted dataclass is used instead of a pydantic model.
+# Frozen because decompose_cpe23 caches the instances and hands the same one to every caller.
+@dataclass(slots=True, frozen=True)
+class CPECreate:
     cpe_name: str
     type: str
     cpe_version: str
@@ -33,8 +38,3 @@ class CPECreate(BaseModel):
     target_sw: str
     target_hw: str
     other: str
-
-    class Config:
-        populate_by_name = True
-        arbitrary_types_allowed = True
-        json_encoders = {ObjectId: str}
@@ -1,138 +1,253 @@
+import dataclasses
+import re
+from functools import lru_cache
+from itertools import chain, islice
+from operator import attrgetter
 from pathlib import Path
-from typing import AsyncGenerator, List
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple
 
-import aiofiles
-import ijson
-from cpe import CPE
+import orjson
+import simdjson
+from cpe.cpe2_3_fs import CPE2_3_FS
 from lxml import etree
 
+from .extractor import open_zip_member
 from .logger import LogManager
 from .models import CPECreate
 
 logger = LogManager('parser.py')
 
-CPE_NAMESPACE = {"cpe23": "http://scap.nist.gov/schema/cpe-extension/2.3"}
+try:
+    # Same API as the default import, but never silently falls back to the pure-Python tokenizer
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    import ijson
 
+    logger.warning(f"ijson C backend is not available, streaming large feeds with the {ijson.backend} backend")
 
-async def parse_xml_in_batches(xml_path: Path, batch_size: int = 2_000) -> AsyncGenerator[List[CPECreate], None]:
+CPE23_ITEM_TAG = "{http://scap.nist.gov/schema/cpe-extension/2.3}cpe23-item"
+
+# Decompressed bytes handed to the XML parser at a time
+XML_READ_SIZE = 1024 * 1024
+
+# Feeds up to this size are parsed in one go by simdjson, bigger ones are streamed with ijson
+MAX_IN_MEMORY_JSON_SIZE = 64 * 1024 * 1024
+
+# (cpe_name, $set payload, Kafka message value)
+CPERecord = Tuple[str, dict, bytes]
+
+# Field order of CPECreate
+CPE_FIELDS = tuple(field.name for field in dataclasses.fields(CPECreate))
+# Everything but the upsert filter key
+PAYLOAD_FIELDS = CPE_FIELDS[1:]
+# Reads all payload fields of a CPECreate in one C call
+get_payload_values = attrgetter(*PAYLOAD_FIELDS)
+
+CPE_TYPES = {"a": "software", "o": "operating_system", "h": "hardware"}
+
+# URIs made only of these values are split directly: for them python-cpe's formatted string and its components
+# are exactly the lowercased input. Anything else (escapes, wildcards, punctuation, empty values, a language tag,
+# which python-cpe validates on its own) goes through python-cpe itself, so cpe_name and what is rejected stay
+# identical to what was stored before.
+CPE23_PLAIN_VALUE = r':(?:[a-z0-9._\-]+|\*)'
+CPE23_PLAIN = re.compile(
+    r'cpe:2\.3:[aoh*\-]'
+    + CPE23_PLAIN_VALUE * 5  # vendor, product, version, update, edition
+    + r':[*\-]'  # language
+    + CPE23_PLAIN_VALUE * 4  # sw_edition, target_sw, target_hw, other
+)
+
+
+def decompose_with_python_cpe(cpe23Uri: str) -> Optional[CPECreate]:
+    try:
+        cpe_obj = CPE2_3_FS(cpe23Uri)
+    except Exception as e:
+        logger.error(f"Error parsing CPE URI {cpe23Uri}: {str(e)}")
+        return None
+
+    cpe_type = (
+        "software" if cpe_obj.is_application() else
+        "operating_system" if cpe_obj.is_operating_system() else
+        "hardware" if cpe_obj.is_hardware() else
+        "other"
+    )
+    version = cpe_obj.get_version()[0]
+
+    return CPECreate(
+        cpe_obj.as_fs(),
+        cpe_type,
+        version,
+        cpe_obj.get_part()[0],
+        cpe_obj.get_vendor()[0],
+        cpe_obj.get_product()[0],
+        version,
+        cpe_obj.get_update()[0],
+        cpe_obj.get_edition()[0],
+        cpe_obj.get_language()[0],
+        cpe_obj.get_software_edition()[0],
+        cpe_obj.get_target_software()[0],
+        cpe_obj.get_target_hardware()[0],
+        cpe_obj.get_other()[0]
+    )
+
+
+# The CVE feeds repeat the same URIs across many CVEs, so each distinct URI is only decomposed once per worker.
+# The cached instances are frozen and shared between batches.
+@lru_cache(maxsize=65_536)
+def decompose_cpe23(cpe23Uri: str) -> Optional[CPECreate]:
+    cpe23Uri_lower = cpe23Uri.lower()
+    if not CPE23_PLAIN.fullmatch(cpe23Uri_lower):
+        return decompose_with_python_cpe(cpe23Uri)
+
+    # cpe:2.3:part:vendor:product:version:update:edition:language:sw_edition:target_sw:target_hw:other
+    (_, _, part, vendor, product, version, update, edition,
+     language, sw_edition, target_sw, target_hw, other) = cpe23Uri_lower.split(':')
+
+    # Positional, in CPE_FIELDS order: no keyword dict is built per CPE
+    return CPECreate(
+        cpe23Uri_lower,
+        CPE_TYPES.get(part, "other"),
+        version,
+        part,
+        vendor,
+        product,
+        version,
+        update,
+        edition,
+        language,
+        sw_edition,
+        target_sw,
+        target_hw,
+        other
+    )
+
+
+def prepare_cpe_batch(cpe23Uris: List[str]) -> List[CPERecord]:
+    records = []
+    # Runs once per URI, so the globals and bound methods are looked up once per batch instead
+    append = records.append
+    decompose = decompose_cpe23
+    dumps = orjson.dumps
+    payload_fields = PAYLOAD_FIELDS
+    payload_values = get_payload_values
+    for cpe23Uri in cpe23Uris:
+        cpe = decompose(cpe23Uri)
+        if cpe is None:
+            continue
+        # cpe_name is the upsert filter, Mongo copies it into inserted documents so $set does not need it
+        payload = dict(zip(payload_fields, payload_values(cpe)))
+        append((cpe.cpe_name, payload, dumps(cpe)))
+    return records
+
+
+def batched(cpe23Uris: Iterable[str], batch_size: int) -> Iterator[List[str]]:
+    # Shared by every feed format, the sources only have to produce URIs
+    cpe23Uris = iter(cpe23Uris)
+    while batch := list(islice(cpe23Uris, batch_size)):
+        yield batch
+
+
+class CPEItemTarget:
+    # Parser target: libxml2 reports the start tags and no Element objects are built at all.
+    # Only start() is defined, so lxml does not call back for end tags or text.
+    def __init__(self):
+        self.cpe23Uris = []
+
+    def start(self, tag, attrib):
+        if tag == CPE23_ITEM_TAG:
+            cpe23Uri = attrib.get("name")
+            if cpe23Uri:
+                self.cpe23Uris.append(cpe23Uri)
+
+    def close(self):
+        return None
+
+
+def iter_xml_cpe23_uris(xml_file: BinaryIO) -> Iterator[str]:
+    target = CPEItemTarget()
+    parser = etree.XMLParser(target=target)
+
+    # Push mode, so only the URIs of the last chunk are held in memory
+    while chunk := xml_file.read(XML_READ_SIZE):
+        parser.feed(chunk)
+        cpe23Uris, target.cpe23Uris = target.cpe23Uris, []
+        yield from cpe23Uris
+
+    parser.close()
+    yield from target.cpe23Uris
+
+
+def parse_xml_in_batches(xml_file: BinaryIO, batch_size: int = 2_000) -> Iterator[List[str]]:
     try:
-        batch = []
-        context = etree.iterparse(str(xml_path), events=("end",), tag="{http://cpe.mitre.org/dictionary/2.0}cpe-item")
-
-        for event, elem in context:
-            cpe23_item = elem.find("cpe23:cpe23-item", namespaces=CPE_NAMESPACE)
-            if cpe23_item is None:
-                continue
-
-            cpe23Uri = cpe23_item.get("name")
-            if not cpe23Uri:
-                continue
-
-            try:
-                cpe_obj = CPE(cpe23Uri)
-            except Exception as e:
-                logger.error(f"Error parsing CPE URI {cpe23Uri}: {str(e)}")
-                continue
-
-            cpe_type = (
-                "software" if cpe_obj.is_application() else
-                "operating_system" if cpe_obj.is_operating_system() else
-                "hardware" if cpe_obj.is_hardware() else
-                "other"
-            )
-
-            cpe = CPECreate(
-                cpe_version=cpe_obj.get_version()[0],
-                part=cpe_obj.get_part()[0],
-                vendor=cpe_obj.get_vendor()[0],
-                product=cpe_obj.get_product()[0],
-                version=cpe_obj.get_version()[0],
-                update=cpe_obj.get_update()[0],
-                edition=cpe_obj.get_edition()[0],
-                language=cpe_obj.get_language()[0],
-                sw_edition=cpe_obj.get_software_edition()[0],
-                target_sw=cpe_obj.get_target_software()[0],
-                target_hw=cpe_obj.get_target_hardware()[0],
-                other=cpe_obj.get_other()[0],
-                cpe_name=cpe_obj.as_fs(),
-                type=cpe_type,
-            )
-
-            batch.append(cpe)
-            elem.clear()
-            while elem.getprevious() is not None:
-                del elem.getparent()[0]
-
-            if len(batch) >= batch_size:
-                logger.info(f"Yielding batch of {len(batch)} CPEs.")
-                yield batch
-                batch = []
-
-        if batch:
-            logger.info(f"Yielding final batch of {len(batch)} CPEs.")
-            yield batch
+        yield from batched(iter_xml_cpe23_uris(xml_file), batch_size)
 
         logger.info("XML streaming parsing completed.")
     except Exception as e:
         logger.error(f"Error while streaming XML: {str(e)}")
 
 
-async def parse_cpes_from_cve_json_in_batches(json_path: Path, batch_size: int = 2_000) -> AsyncGenerator[
-    List[CPECreate], None]:
+def parse_xml_archive_in_batches(zip_path: Path, batch_size: int = 2_000) -> Iterator[List[str]]:
+    # The dictionary is parsed while it is being decompressed, it never hits the disk uncompressed
+    with open_zip_member(zip_path) as xml_file:
+        yield from parse_xml_in_batches(xml_file, batch_size)
+
+
+def iter_cve_item_cpe23_uris(cve_item) -> Iterator[str]:
+    # Works on plain dicts from ijson as well as on simdjson's lazy proxies
+    configurations = cve_item.get("configurations", {})
+    nodes = configurations.get("nodes", [])
+
+    for node in nodes:
+        cpe_matches = node.get("cpe_match", [])
+
+        for match in cpe_matches:
+            cpe23Uri = match.get('cpe23Uri')
+            if cpe23Uri:
+                yield cpe23Uri
+
+
+def load_cve_cpe23_uris(json_path: Path) -> List[str]:
+    # simdjson only materializes the cpe23Uri strings, the rest of the document stays in its parsed tape
+    document = simdjson.Parser().load(str(json_path))
+    cpe23Uris = []
+    for cve_item in document.get("CVE_Items", []):
+        try:
+            # One lookup in C instead of walking configurations -> nodes through proxies
+            nodes = cve_item.at_pointer("/configurations/nodes")
+        except KeyError:
+            continue
+        matches = chain.from_iterable(node.get("cpe_match", ()) for node in nodes)
+        cpe23Uris.extend(filter(None, (match.get("cpe23Uri") for match in matches)))
+    return cpe23Uris
+
+
+def stream_cve_cpe23_uris(json_path: Path) -> Iterator[str]:
+    with open(json_path, "rb") as json_file:
+        for cve_item in ijson.items(json_file, "CVE_Items.item"):
+            yield from iter_cve_item_cpe23_uris(cve_item)
+
+
+def parse_cpes_from_cve_json_in_batches(json_path: Path, batch_size: int = 2_000) -> Iterator[List[str]]:
     try:
-        batch = []
-        async with aiofiles.open(json_path, "rb") as json_file:
-            async for cve_item in ijson.items(json_file, "CVE_Items.item"):
-                configurations = cve_item.get("configurations", {})
-                nodes = configurations.get("nodes", [])
-
-                for node in nodes:
-                    cpe_matches = node.get("cpe_match", [])
-
-                    for match in cpe_matches:
-                        cpe23Uri = match.get('cpe23Uri')
-                        if not cpe23Uri:
-                            continue
-
-                        try:
-                            cpe_obj = CPE(cpe23Uri)
-                        except Exception as e:
-                            logger.error(f"Error parsing CPE URI {cpe23Uri}: {str(e)}")
-                            continue
-
-                        cpe_type = (
-                            "software" if cpe_obj.is_application() else
-                            "operating_system" if cpe_obj.is_operating_system() else
-                            "hardware" if cpe_obj.is_hardware() else
-                            "other"
-                        )
-
-                        cpe = CPECreate(
-                            cpe_name=cpe_obj.as_fs(),
-                            type=cpe_type,
-                            cpe_version=cpe_obj.get_version()[0],
-                            part=cpe_obj.get_part()[0],
-                            vendor=cpe_obj.get_vendor()[0],
-                            product=cpe_obj.get_product()[0],
-                            version=cpe_obj.get_version()[0],
-                            update=cpe_obj.get_update()[0],
-                            edition=cpe_obj.get_edition()[0],
-                            language=cpe_obj.get_language()[0],
-                            sw_edition=cpe_obj.get_software_edition()[0],
-                            target_sw=cpe_obj.get_target_software()[0],
-                            target_hw=cpe_obj.get_target_hardware()[0],
-                            other=cpe_obj.get_other()[0]
-                        )
-
-                        batch.append(cpe)
-
-                        if len(batch) >= batch_size:
-                            yield batch
-                            batch = []
-
-        if batch:
-            yield batch
+        if json_path.stat().st_size <= MAX_IN_MEMORY_JSON_SIZE:
+            cpe23Uris = load_cve_cpe23_uris(json_path)
+        else:
+            cpe23Uris = stream_cve_cpe23_uris(json_path)
+        yield from batched(cpe23Uris, batch_size)
 
         logger.info("CPE parsing from CVE JSON completed.")
     except Exception as e:
         logger.error(f"Error while streaming JSON for CPEs: {str(e)}")
+
+
+# Entry point of the parser processes: the whole CPU-bound part of an ingest runs here and
+# only batches that are ready to be written are handed back through the (Manager) queue.
+# stop is set when the ingest gives up early, the worker then skips the rest of the file.
+def parse_file_to_queue(parse_in_batches: Callable[[Path], Iterator[List[str]]], path: Path, queue, stop) -> None:
+    try:
+        for cpe23Uris in parse_in_batches(path):
+            if stop.is_set():
+                break
+            queue.put(prepare_cpe_batch(cpe23Uris))
+    finally:
+        queue.put(None)
@@ -1,5 +1,5 @@
 from bson import ObjectId
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 
 class PyObjectId(ObjectId):
@@ -35,14 +35,14 @@ class CPEBase(BaseModel):
     target_hw: str
     other: str
 
-    class Config:
-        populate_by_name = True
-        arbitrary_types_allowed = True
-        json_encoders = {ObjectId: str}
-
-
-class CPECreate(CPEBase):
-    pass
+    model_config = ConfigDict(
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+        json_encoders={ObjectId: str},
+        ser_json_bytes='utf8',
+        validate_assignment=False,
+        extra='ignore',
+    )
 
 
 class CPEResponse(CPEBase):